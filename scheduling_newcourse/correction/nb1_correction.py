@@ -1,62 +1,245 @@
+import heapq
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+try:
+    from scipy.ndimage import minimum_filter1d
+except ImportError:
+    minimum_filter1d = None
 from typing import List, Hashable
+from correction.nb1_sgs_numba import sgs_numba, sgs_numba_specialized
+
+
+def precedence_csr(rcpsp_model: RCPSPModel, task_to_idx, predecessors=None):
+    # Encode the precedence graph in CSR format, with tasks given by their index in rcpsp_model.tasks_list :
+    # predecessors of task i are pred_indices[pred_indptr[i]:pred_indptr[i+1]], same for successors.
+    n = len(task_to_idx)
+    if predecessors is None:
+        src = np.array([task_to_idx[k] for k in rcpsp_model.successors for s in rcpsp_model.successors[k]], dtype=np.int64)
+        dst = np.array([task_to_idx[s] for k in rcpsp_model.successors for s in rcpsp_model.successors[k]], dtype=np.int64)
+    else:
+        src = np.array([task_to_idx[p] for k in predecessors for p in predecessors[k]], dtype=np.int64)
+        dst = np.array([task_to_idx[k] for k in predecessors for p in predecessors[k]], dtype=np.int64)
+    pred_indptr = np.zeros(n+1, dtype=np.int64)
+    pred_indptr[1:] = np.cumsum(np.bincount(dst, minlength=n))
+    pred_indices = src[np.argsort(dst, kind="stable")]
+    succ_indptr = np.zeros(n+1, dtype=np.int64)
+    succ_indptr[1:] = np.cumsum(np.bincount(src, minlength=n))
+    succ_indices = dst[np.argsort(src, kind="stable")]
+    return pred_indptr, pred_indices, succ_indptr, succ_indices
+
+
+def sgs_cache(rcpsp_model: RCPSPModel):
+    # Read-only data of the problem used by the sgs : task indexes, precedence graph in CSR format,
+    # durations and resource consumptions. Built on first call and kept on the model,
+    # so that repeated sgs calls don't rebuild it. Arrays are read-only, so the cache can be shared across threads.
+    cache = getattr(rcpsp_model, "_sgs_cache", None)
+    if cache is None:
+        tasks_list = list(rcpsp_model.tasks_list)
+        task_to_idx = {t: i for i, t in enumerate(tasks_list)}
+        resources_list = list(rcpsp_model.resources_list)
+        pred_indptr, pred_indices, succ_indptr, succ_indices = precedence_csr(rcpsp_model, task_to_idx)
+        cache = {"tasks_list": tasks_list,
+                 "task_to_idx": task_to_idx,
+                 "resources_list": resources_list,
+                 "pred_indptr": pred_indptr,
+                 "pred_indices": pred_indices,
+                 "succ_indptr": succ_indptr,
+                 "succ_indices": succ_indices,
+                 "duration_arr": np.array([rcpsp_model.mode_details[t][1]["duration"] for t in tasks_list],
+                                          dtype=np.int32),
+                 "need_arr": np.array([[rcpsp_model.mode_details[t][1].get(r, 0) for r in resources_list]
+                                       for t in tasks_list], dtype=np.int32),
+                 "non_renewable": np.array([r in rcpsp_model.non_renewable_resources for r in resources_list],
+                                           dtype=bool)}
+        # Zero duration tasks consuming no non-renewable resource (source, sink, milestones...) :
+        # scheduling them needs neither resource search nor resource update.
+        cache["instant"] = (cache["duration_arr"] == 0) & ~(cache["need_arr"][:, cache["non_renewable"]] != 0).any(axis=1)
+        for key in cache:
+            if isinstance(cache[key], np.ndarray):
+                cache[key].setflags(write=False)
+        rcpsp_model._sgs_cache = cache
+    return cache
+
+
+def sgs_workspace(rcpsp_model: RCPSPModel):
+    # Resource availability matrix [resource, time] (read-only template) and a new buffer of the same shape.
+    # A caller doing many sgs calls (local search, genetic algorithm...) can create one workspace and pass it
+    # as _workspace : each call then resets the buffer from the template instead of converting the calendars
+    # to a new matrix. One workspace per thread : sgs calls sharing a workspace must not run concurrently.
+    # The matrix is padded after the horizon with max duration columns of 0 availability : windows starting
+    # before the horizon always fit in the matrix, and a task using a resource can't run past the horizon.
+    # The template is read from the calendars of the model when the workspace is created : sgs calls without
+    # _workspace create their own and always see the current calendars, after modifying a calendar of the model,
+    # create a new workspace.
+    cache = sgs_cache(rcpsp_model)
+    padding = int(cache["duration_arr"].max()) if len(cache["duration_arr"]) > 0 else 0
+    avail_template = np.zeros((len(cache["resources_list"]), rcpsp_model.horizon+padding), dtype=np.int32)
+    for ri, r in enumerate(cache["resources_list"]):
+        avail_template[ri, :rcpsp_model.horizon] = np.asarray(rcpsp_model.get_resource_availability_array(r),
+                                                              dtype=np.int32)[:rcpsp_model.horizon]
+    avail_template.setflags(write=False)
+    return {"avail_template": avail_template,
+            "avail_buffer": np.empty_like(avail_template)}
+
+
+def window_minimum(avail, duration):
+    # For each row r and time t, minimum of avail[r, t:t+duration],
+    # windows going beyond the end of the array are padded with -1 so that they are never feasible.
+    if duration == 1:
+        return avail.copy()
+    if minimum_filter1d is not None:
+        # O(time) per row whatever the duration.
+        return minimum_filter1d(avail, size=duration, axis=1, mode="constant", cval=-1, origin=-(duration//2))
+    # Without scipy : sliding_window_view only changes strides (no copy), the min is then a single vectorized
+    # reduction, in O(time*duration) per row.
+    window_min = np.full(avail.shape, -1, dtype=avail.dtype)
+    if duration <= avail.shape[1]:
+        window_min[:, :avail.shape[1]-duration+1] = sliding_window_view(avail, duration, axis=1).min(axis=-1)
+    return window_min
+
+
 def sgs_algorithm(rcpsp_model: RCPSPModel, 
-                  permutation_of_task: List[Hashable], predecessors=None):
-    # Compute predecessors for each task. 
+                  permutation_of_task: List[Hashable], predecessors=None, _workspace=None):
+    cache = sgs_cache(rcpsp_model)
+    tasks_list = cache["tasks_list"]
+    task_to_idx = cache["task_to_idx"]
+    # Successors of each task in the precedence graph of the model (CSR format) : minimum start times are propagated along it.
+    succ_indptr, succ_indices = cache["succ_indptr"], cache["succ_indices"]
+    # Graph deciding when a task is ready to be scheduled (all its predecessors done) : the one of the model,
+    # or the one given by the predecessors argument, which doesn't change the minimum start times propagation.
     if predecessors is None:
-        predecessors = {k: set() for k in rcpsp_model.tasks_list}
-        for k in rcpsp_model.successors:
-            succ = rcpsp_model.successors[k]
-            for s in succ:
-                predecessors[s].add(k)
+        pred_indptr, ready_succ_indptr, ready_succ_indices = cache["pred_indptr"], succ_indptr, succ_indices
+    else:
+        pred_indptr, _, ready_succ_indptr, ready_succ_indices = precedence_csr(rcpsp_model, task_to_idx, predecessors)
     # Store partial schedule
     schedule = {k: {"start_time": None,
                     "end_time": None}
-                for k in rcpsp_model.tasks_list}
-    # Duration of task
-    duration_task = {k: rcpsp_model.mode_details[k][1]["duration"] for k in rcpsp_model.mode_details}
-    # object to keep track of resource availability through time.
-    resources_availability = {r: np.array(rcpsp_model.get_resource_availability_array(r))
-                              for r in rcpsp_model.resources_list}
-    # Store all the task that are added to the schedule.
-    done = set()
+                for k in tasks_list}
+    # Duration of task, indexed by task index.
+    duration_arr = cache["duration_arr"]
+    # Matrix [resource, time] keeping track of resource availability through time, resources indexed by position.
+    if _workspace is None:
+        _workspace = sgs_workspace(rcpsp_model)
+    avail = _workspace["avail_buffer"]
+    np.copyto(avail, _workspace["avail_template"])
+    non_renewable = cache["non_renewable"]
+    # Matrix [task, resource] of resource consumption.
+    need = cache["need_arr"]
+    # Cache of window_minimum(avail, d) for each duration d met so far, tasks with same duration share it.
+    window_min = {}
+    # For each cached duration, resources rows and time span [lo, hi) of the windows changed since last refresh.
+    window_dirty = {}
+    # Number of tasks added to the schedule.
+    n_done = 0
     # Store the minimum starting time of a task.
     minimum_time = {t: 0 for t in rcpsp_model.tasks_list}
+    # Position of each task in the permutation, used as priority.
+    perm_index = {task_to_idx[t]: i for i, t in enumerate(permutation_of_task)}
+    # Number of predecessors of each task that are not scheduled yet.
+    pred_remaining = (pred_indptr[1:]-pred_indptr[:-1]).astype(np.int32)
+    # Heap of the tasks whose all predecessors are done, ordered by their position in the permutation.
+    ready = [(perm_index[ti], ti) for ti in perm_index if pred_remaining[ti] == 0]
+    heapq.heapify(ready)
+    instant = cache["instant"]
+
+    def release_successors(task_idx, end_time):
+        # Update the minimum time to start the successors of the task we just scheduled.
+        for si in succ_indices[succ_indptr[task_idx]:succ_indptr[task_idx+1]]:
+            s = tasks_list[si]
+            minimum_time[s] = max(minimum_time[s], end_time)
+        # Tasks whose predecessors are now all scheduled become ready.
+        for si in ready_succ_indices[ready_succ_indptr[task_idx]:ready_succ_indptr[task_idx+1]]:
+            pred_remaining[si] -= 1
+            if pred_remaining[si] == 0:
+                heapq.heappush(ready, (perm_index[si], si))
+
     while True:
+        # Instant tasks (see sgs_cache) coming next in the permutation are scheduled in a batch at their minimum time.
+        # Only the head of the heap is drained, so that the order of the permutation is kept.
+        while ready and instant[ready[0][1]]:
+            _, task_idx = heapq.heappop(ready)
+            task = tasks_list[task_idx]
+            schedule[task]["start_time"] = minimum_time[task]
+            schedule[task]["end_time"] = minimum_time[task]
+            release_successors(task_idx, minimum_time[task])
+            n_done += 1
+        # If all tasks are done, we finish.
+        if n_done == len(tasks_list):
+            break
         # Here, we select the next task in "permutation_of_task", whose all predecessors are done, and that is not done itself.
-        next_task = next(x for x in permutation_of_task 
-                         if all(p in done for p in predecessors[x]) 
-                         and x not in done)
-        # We distinguish task with 0 duration (for whcih we don't look at resource availability..)
-        if duration_task[next_task] == 0:
+        _, next_task_idx = heapq.heappop(ready)
+        next_task = tasks_list[next_task_idx]
+        duration = int(duration_arr[next_task_idx])
+        # We distinguish task with 0 duration (for whcih we don't look at resource availability..),
+        # the ones reaching this point consume some non-renewable resource.
+        if duration == 0:
             time_to_schedule_task = minimum_time[next_task]
         else:
             # Look for the smallest timestamp where the resource availability is >= than the resource demand of the task, 
-            # and for the entire execution time of the task (hence the resources_availability[r][t:t+duration_task[next_task]])
-            time_to_schedule_task = next(t for t in range(minimum_time[next_task], rcpsp_model.horizon)
-                                         if 
-                                         all(min(resources_availability[r][t:t+duration_task[next_task]])>=
-                                             rcpsp_model.mode_details[next_task][1][r]
-                                             for r in resources_availability))
+            # and for the entire execution time of the task.
+            # window_min[duration][r, t] is the minimum of avail[r, t:t+duration].
+            if duration not in window_min:
+                window_min[duration] = window_minimum(avail, duration)
+                window_dirty[duration] = None
+            elif window_dirty[duration] is not None:
+                # Only recompute the windows overlapping the resource updates since the last use of this duration.
+                rows, lo, hi = window_dirty[duration]
+                window_min[duration][rows, lo:hi] = window_minimum(avail[rows, lo:hi+duration-1], duration)[:, :hi-lo]
+                window_dirty[duration] = None
+            # Only start times before the horizon are considered.
+            feasible = (window_min[duration][:, minimum_time[next_task]:rcpsp_model.horizon]
+                        >= need[next_task_idx][:, None]).all(axis=0)
+            if feasible.any():
+                time_to_schedule_task = minimum_time[next_task]+int(np.argmax(feasible))
+            else:
+                # No slot before the horizon : the task is pushed at the horizon, the schedule won't be feasible.
+                time_to_schedule_task = max(minimum_time[next_task], rcpsp_model.horizon)
         # We found the right time to schedule the task ! 
         schedule[next_task]["start_time"] = time_to_schedule_task
-        schedule[next_task]["end_time"] = time_to_schedule_task+duration_task[next_task]
+        schedule[next_task]["end_time"] = time_to_schedule_task+duration
         # Update the resource availability with the task we just schedule.
-        for r in resources_availability:
-            need = rcpsp_model.mode_details[next_task][1][r]
-            if r in rcpsp_model.non_renewable_resources:
-                resources_availability[r][schedule[next_task]["start_time"]:]-=need
-            else:
-                resources_availability[r][schedule[next_task]["start_time"]:schedule[next_task]["end_time"]]-=need
-        # Update the minimum time to start the successors of the task we just scheduled.
-        for s in rcpsp_model.successors[next_task]:
-            minimum_time[s] = max(minimum_time[s], schedule[next_task]["end_time"])
-        # Adding current task to done, so we don't pick it later ! 
-        done.add(next_task) 
-        # If all tasks are done, we finish.
-        if all(x in done for x in schedule):
-            break
+        task_need = need[next_task_idx]
+        for rows, start, end in ((~non_renewable & (task_need != 0), time_to_schedule_task, schedule[next_task]["end_time"]),
+                                 (non_renewable & (task_need != 0), time_to_schedule_task, rcpsp_model.horizon)):
+            if not rows.any() or start >= end:
+                continue
+            avail[rows, start:end] -= task_need[rows, None]
+            # Only the windows of the updated resources overlapping [start, end) are changed, flag them in the cache.
+            for d in window_min:
+                if window_dirty[d] is None:
+                    window_dirty[d] = (rows, max(0, start-d+1), end)
+                else:
+                    window_dirty[d] = (window_dirty[d][0] | rows,
+                                       max(0, min(window_dirty[d][1], start-d+1)), max(window_dirty[d][2], end))
+        release_successors(next_task_idx, schedule[next_task]["end_time"])
+        # Counting current task as done.
+        n_done += 1
     return schedule  
 
 
 
+
+
+def sgs_algorithm_numba(rcpsp_model: RCPSPModel,
+                        permutation_of_task: List[Hashable], specialized=False, _workspace=None):
+    # Same algorithm as sgs_algorithm, with the main loop compiled by numba (see correction/nb1_sgs_numba.py).
+    # By default the generic kernel is used, compiled once and kept in numba disk cache.
+    # specialized : use a kernel generated for the resources of this problem, faster but compiled again (a few seconds)
+    # on the first call of each python session, only worth it for a very large number of sgs calls.
+    cache = sgs_cache(rcpsp_model)
+    tasks_list = cache["tasks_list"]
+    task_to_idx = cache["task_to_idx"]
+    if _workspace is None:
+        _workspace = sgs_workspace(rcpsp_model)
+    avail = _workspace["avail_buffer"]
+    np.copyto(avail, _workspace["avail_template"])
+    succ_indptr, succ_indices = cache["succ_indptr"], cache["succ_indices"]
+    pred_count = cache["pred_indptr"][1:]-cache["pred_indptr"][:-1]
+    perm_index = np.empty(len(tasks_list), dtype=np.int64)
+    perm_index[[task_to_idx[t] for t in permutation_of_task]] = np.arange(len(permutation_of_task))
+    kernel = sgs_numba_specialized(~cache["non_renewable"]) if specialized else sgs_numba
+    starts, ends = kernel(avail, cache["need_arr"], ~cache["non_renewable"], succ_indptr, succ_indices,
+                          pred_count, perm_index, cache["duration_arr"], rcpsp_model.horizon)
+    return {t: {"start_time": int(starts[i]),
+                "end_time": int(ends[i])}
+            for i, t in enumerate(tasks_list)}
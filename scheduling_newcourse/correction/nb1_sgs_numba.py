@@ -0,0 +1,158 @@
+import types
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True)
+def heap_push(heap, heap_size, value):
+    # Push value in the binary min-heap heap[:heap_size], return the new size.
+    heap[heap_size] = value
+    child = heap_size
+    while child > 0 and heap[(child - 1) // 2] > heap[child]:
+        parent = (child - 1) // 2
+        heap[parent], heap[child] = heap[child], heap[parent]
+        child = parent
+    return heap_size + 1
+
+
+@njit(cache=True)
+def heap_pop(heap, heap_size):
+    # Pop the minimum of the binary min-heap heap[:heap_size], return it and the new size.
+    top = heap[0]
+    heap_size -= 1
+    heap[0] = heap[heap_size]
+    parent = 0
+    while True:
+        child = 2 * parent + 1
+        if child >= heap_size:
+            break
+        if child + 1 < heap_size and heap[child + 1] < heap[child]:
+            child += 1
+        if heap[parent] <= heap[child]:
+            break
+        heap[parent], heap[child] = heap[child], heap[parent]
+        parent = child
+    return top, heap_size
+
+
+@njit(cache=True, inline="always")
+def task_fits(avail, need, renewable, task, t):
+    # True when the availability at time t covers the need of task on every resource.
+    for r in range(avail.shape[0]):
+        if avail[r, t] < need[task, r]:
+            return False
+    return True
+
+
+@njit(cache=True, inline="always")
+def task_consume(avail, need, renewable, task, start, d, horizon):
+    # Remove the consumption of task scheduled at start from the availability,
+    # on [start, start+d) for renewable resources and [start, horizon) for non-renewable ones.
+    for r in range(avail.shape[0]):
+        end = min(start + d, avail.shape[1]) if renewable[r] else horizon
+        for t in range(start, end):
+            avail[r, t] -= need[task, r]
+
+
+def sgs_kernel(avail,           # array(resource, time) -> availability (zero padded after the horizon), modified in place
+               need,            # array(task, resource) -> consumption
+               renewable,       # array(resource) -> bool
+               succ_indptr,     # CSR successors : successors of task i are succ_indices[succ_indptr[i]:succ_indptr[i+1]]
+               succ_indices,
+               pred_count,      # array(task) -> number of predecessors
+               perm_index,      # array(task) -> position of the task in the permutation
+               duration,        # array(task) -> duration
+               horizon):
+    # Body of sgs_numba and of the specialized kernels (see sgs_numba_specialized),
+    # which only differ by the task_fits and task_consume functions they are compiled with.
+    n_tasks = need.shape[0]
+    starts = np.zeros(n_tasks, dtype=np.int64)
+    ends = np.zeros(n_tasks, dtype=np.int64)
+    minimum_time = np.zeros(n_tasks, dtype=np.int64)
+    pred_remaining = pred_count.copy()
+    # Task at each position of the permutation.
+    task_at = np.empty(n_tasks, dtype=np.int64)
+    for i in range(n_tasks):
+        task_at[perm_index[i]] = i
+    # Binary min-heap of the permutation positions of ready tasks.
+    heap = np.empty(n_tasks, dtype=np.int64)
+    heap_size = 0
+    for i in range(n_tasks):
+        if pred_remaining[i] == 0:
+            heap_size = heap_push(heap, heap_size, perm_index[i])
+    while heap_size > 0:
+        # Pop the ready task coming first in the permutation.
+        position, heap_size = heap_pop(heap, heap_size)
+        task = task_at[position]
+        d = duration[task]
+        start = minimum_time[task]
+        if d > 0:
+            # A window is feasible when every time in it covers the need of the task on every resource :
+            # count the consecutive feasible times, the first run of length d gives the start.
+            # Windows start before the horizon, and end at most in the zero padding of avail.
+            run = 0
+            found = False
+            for t in range(minimum_time[task], horizon + d - 1):
+                run = run + 1 if task_fits(avail, need, renewable, task, t) else 0
+                if run == d:
+                    start = t - d + 1
+                    found = True
+                    break
+            if not found:
+                # No slot before the horizon : the task is pushed at the horizon, the schedule won't be feasible.
+                start = max(minimum_time[task], horizon)
+        starts[task] = start
+        ends[task] = start + d
+        task_consume(avail, need, renewable, task, start, d, horizon)
+        # Successors whose predecessors are now all scheduled become ready.
+        for k in range(succ_indptr[task], succ_indptr[task + 1]):
+            s = succ_indices[k]
+            minimum_time[s] = max(minimum_time[s], ends[task])
+            pred_remaining[s] -= 1
+            if pred_remaining[s] == 0:
+                heap_size = heap_push(heap, heap_size, perm_index[s])
+    return starts, ends
+
+
+sgs_numba = njit(cache=True)(sgs_kernel)
+
+
+# task_fits and task_consume written for one resource signature (number of resources, renewable or not) :
+# the loops over resources are unrolled and the renewable flags are constants.
+# {fits} and {consume} are generated by sgs_numba_specialized.
+SGS_SPECIALIZED_TEMPLATE = """
+def task_fits(avail, need, renewable, task, t):
+{fits}
+    return True
+
+
+def task_consume(avail, need, renewable, task, start, d, horizon):
+{consume}
+"""
+
+# Above this number of resources, the generic sgs_numba is used.
+SGS_SPECIALIZED_MAX_RESOURCES = 8
+
+_sgs_specialized_kernels = {}
+
+
+def sgs_numba_specialized(renewable):
+    # Kernel with the same signature as sgs_numba, specialized for the given renewable flags (one per resource) :
+    # sgs_kernel compiled with generated task_fits and task_consume instead of the generic ones.
+    # Generated and compiled on first call for each signature, then kept for the next calls.
+    # Code built by exec can't use the numba disk cache : compilation (a few seconds) is done once per process.
+    signature = tuple(bool(x) for x in renewable)
+    if len(signature) > SGS_SPECIALIZED_MAX_RESOURCES:
+        return sgs_numba
+    if signature not in _sgs_specialized_kernels:
+        fits = "\n".join([f"    if avail[{r}, t] < need[task, {r}]:\n        return False" for r in range(len(signature))])
+        consume = "\n".join([f"    for t in range(start, {'min(start + d, avail.shape[1])' if signature[r] else 'horizon'}):\n"
+                             f"        avail[{r}, t] -= need[task, {r}]" for r in range(len(signature))]) or "    pass"
+        namespace = {"np": np}
+        exec(SGS_SPECIALIZED_TEMPLATE.format(fits=fits, consume=consume), namespace)
+        # Same code as sgs_kernel, with globals where task_fits and task_consume are the generated ones.
+        kernel_globals = dict(globals(), task_fits=njit(inline="always")(namespace["task_fits"]),
+                              task_consume=njit(inline="always")(namespace["task_consume"]))
+        kernel = types.FunctionType(sgs_kernel.__code__, kernel_globals, "sgs_numba_specialized_kernel")
+        _sgs_specialized_kernels[signature] = njit(kernel)
+    return _sgs_specialized_kernels[signature]
@@ -1,4 +1,5 @@
-from typing import List
+import numpy as np
+from typing import List, Optional
 from ortools.sat.python import cp_model
 from typing import Tuple
 
@@ -45,42 +46,72 @@ class SolverJobShop:
         self.model = cp_model.CpModel()
         self.variables = {}
     
-    def init_model(self, max_time: int = 300):
+    def init_model(self, max_time: int = 300, hint: Optional[SolutionJobshop] = None):
         # Write variables, constraints
+        # Variables are created with the CpModel API (some ortools versions keep track of them on the python side),
+        # then referred to by their index in the proto : the constraints are appended directly to the underlying
+        # CpModelProto, which avoids creating one python wrapper object per interval / constraint for big instances.
+        proto = self.model.Proto()
 
+        # Processing time of the k-th part of job j.
+        proc_time = [[subjob.processing_time for subjob in self.jobshop_problem.list_jobs[j]]
+                     for j in range(self.jobshop_problem.n_jobs)]
         # Create array of variables :
-        # starts[j][k] store the start date of the k-th part of job j
-        starts = [[self.model.NewIntVar(0, max_time, f"starts_{j,k}")
+        # starts[j][k] store the index of the start date of the k-th part of job j
+        # As the processing time is fixed, the end date is the expression starts[j][k]+proc_time[j][k],
+        # no variable is needed for it.
+        starts = [[self.model.NewIntVar(0, max_time-proc_time[j][k], f"starts_{j,k}").Index()
                    for k in range(len(self.jobshop_problem.list_jobs[j]))]
                   for j in range(self.jobshop_problem.n_jobs)]
-        # Same idea for ends
-        ends = [[self.model.NewIntVar(0, max_time, f"ends_{j, k}")
-                 for k in range(len(self.jobshop_problem.list_jobs[j]))]
-                for j in range(self.jobshop_problem.n_jobs)]
-        # Create the interval variables from starts and ends, and add the procession time of the task in the size attribute.
-        intervals = [[self.model.NewIntervalVar(start=starts[j][k],
-                                                size=self.jobshop_problem.list_jobs[j][k].processing_time,
-                                                end=ends[j][k],
-                                                name=f"task_{j, k}")
-                     for k in range(len(self.jobshop_problem.list_jobs[j]))]
+        # Create the interval constraints from starts, and add the procession time of the task in the size attribute.
+        intervals = [[None for k in range(len(self.jobshop_problem.list_jobs[j]))]
                      for j in range(self.jobshop_problem.n_jobs)]
-        # Precedence constraint between successives subparts of each job.
+        for j in range(self.jobshop_problem.n_jobs):
+            for k in range(len(self.jobshop_problem.list_jobs[j])):
+                constraint = proto.constraints.add()
+                constraint.name = f"task_{j, k}"
+                interval = constraint.interval
+                interval.start.vars.append(starts[j][k])
+                interval.start.coeffs.append(1)
+                interval.end.vars.append(starts[j][k])
+                interval.end.coeffs.append(1)
+                interval.end.offset = proc_time[j][k]
+                interval.size.offset = proc_time[j][k]
+                intervals[j][k] = len(proto.constraints) - 1
+        # Precedence constraint between successives subparts of each job : proc_time[j][k-1] <= starts[j][k]-starts[j][k-1]
         for j in range(self.jobshop_problem.n_jobs):
             for k in range(1, len(self.jobshop_problem.list_jobs[j])):
-                self.model.Add(starts[j][k] >= ends[j][k-1])
+                constraint = proto.constraints.add()
+                constraint.linear.vars.extend([starts[j][k], starts[j][k-1]])
+                constraint.linear.coeffs.extend([1, -1])
+                constraint.linear.domain.extend([proc_time[j][k-1], max_time])
         # No overlap task on the same machine.
         for machine in self.jobshop_problem.job_per_machines:
-            self.model.AddNoOverlap([intervals[x[0]][x[1]]
-                                     for x in self.jobshop_problem.job_per_machines[machine]])
+            constraint = proto.constraints.add()
+            constraint.no_overlap.intervals.extend([intervals[x[0]][x[1]]
+                                                    for x in self.jobshop_problem.job_per_machines[machine]])
         # Objective value variable
         makespan = self.model.NewIntVar(0, max_time, name="makespan")
-        # Set it to the maximum value of ending times of last subjob of jobs.
-        self.model.AddMaxEquality(makespan, [ends[i][-1] for i in range(len(ends))
-                                             for j in range(len(ends[i]))])
+        # Set it to the maximum value of ending times of last subjob of jobs (start + processing time).
+        last_ends = [cp_model.LinearExpr.Sum([self.model.GetIntVarFromProtoIndex(starts[i][-1]), proc_time[i][-1]])
+                     for i in range(len(starts))]
+        self.model.AddMaxEquality(makespan, last_ends)
         self.model.Minimize(makespan)
-        # Store the variables in some dictionnaries.
+        # Warm start : a schedule of a previous (similar) instance with the same job structure is given as hint to the solver.
+        if hint is not None and [len(x) for x in hint.schedule] == [len(x) for x in starts]:
+            proto.solution_hint.vars.extend([starts[j][k] for j in range(len(starts))
+                                             for k in range(len(starts[j]))])
+            proto.solution_hint.values.extend([int(hint.schedule[j][k][0]) for j in range(len(starts))
+                                               for k in range(len(starts[j]))])
+        elif hint is not None:
+            print("Hint ignored, number of subjobs per job doesn't match the problem : ",
+                  [len(x) for x in hint.schedule])
+        # Store the variables indexes in some dictionnaries.
         self.variables["starts"] = starts
-        self.variables["ends"] = ends
+        self.variables["proc_time"] = proc_time
+        # Flat arrays (job after job) of start variable indexes and processing times, to read the solution in bulk.
+        self.variables["starts_flat"] = np.array([x for job in starts for x in job], dtype=np.int64)
+        self.variables["proc_time_flat"] = np.array([x for job in proc_time for x in job], dtype=np.int64)
         
     def solve(self, **kwargs) -> SolutionJobshop:
         self.init_model(**kwargs)
@@ -89,12 +120,19 @@ class SolverJobShop:
         status = solver.Solve(self.model)
         status_human = solver.StatusName(status)
         print("Solver finished ", status_human)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            # No solution found (infeasible, or time limit reached before the first solution) : empty schedule.
+            return SolutionJobshop([[] for job in range(self.jobshop_problem.n_jobs)])
         print("Objective value : ", solver.ObjectiveValue())
+        # Values of all the variables at once, indexed as in the model proto.
+        values = np.array(solver.ResponseProto().solution, dtype=np.int64)
+        starts_np = values[self.variables["starts_flat"]]
+        starts = starts_np.tolist()
+        ends = (starts_np+self.variables["proc_time_flat"]).tolist()
         schedule = []
+        index = 0
         for job in range(self.jobshop_problem.n_jobs):
-            sch = []
-            for subjob in range(len(self.variables["starts"][job])):
-                sch += [(solver.Value(self.variables["starts"][job][subjob]),
-                         solver.Value(self.variables["ends"][job][subjob]))]
-            schedule += [sch]
+            n_subjobs = len(self.variables["starts"][job])
+            schedule += [list(zip(starts[index:index+n_subjobs], ends[index:index+n_subjobs]))]
+            index += n_subjobs
         return SolutionJobshop(schedule)
\ No newline at end of file
@@ -7,13 +7,13 @@ def exercise_model(N=20):
     Y_prime = model.NewBoolVarSeries("Y_prime", df.index[:-1])
     Z = model.NewIntVar(lb=0, ub=2*N, name="Z")
     for i in range(N-1):
-        # Here we set equivalence between Y_prime[i] and (X[i]==X[i+1])
-        model.Add(X[i]==X[i+1]).OnlyEnforceIf(Y_prime[i])
-        model.Add(X[i]!=X[i+1]).OnlyEnforceIf(Y_prime[i].Not())
+        # Here we set equivalence between Y_prime[i] and (X[i]==X[i+1]) :
+        # X[i] xor X[i+1] xor Y_prime[i] is true iff Y_prime[i] is the negation of (X[i] xor X[i+1])
+        model.AddBoolXOr([X[i], X[i+1], Y_prime[i]])
         # if X[i]==X[i+1] then Y[i]==True, which is what we wanted !! 
-        model.Add(Y[i]==True).OnlyEnforceIf(Y_prime[i])
+        model.AddImplication(Y_prime[i], Y[i])
     for i in range(N-3):
         model.Add(Y[i]!=Y[i+2])
-    model.Add(sum(X[::3])+sum(Y)==Z)
+    model.Add(cp_model.LinearExpr.Sum(list(X[::3])+list(Y))==Z)
     model.Maximize(Z)
     return model, X, Y, Z
@@ -1,51 +1,149 @@
+import heapq
 import numpy as np
 from typing import List, Hashable
+
+
+def precedence_csr(rcpsp_model: RCPSPModel, task_to_idx, predecessors=None):
+    # Precedence graph in CSR format, tasks given by their index in rcpsp_model.tasks_list :
+    # predecessors of task i are pred_indices[pred_indptr[i]:pred_indptr[i+1]], same for successors.
+    n = len(task_to_idx)
+    if predecessors is None:
+        src = np.array([task_to_idx[k] for k in rcpsp_model.successors for s in rcpsp_model.successors[k]], dtype=np.int64)
+        dst = np.array([task_to_idx[s] for k in rcpsp_model.successors for s in rcpsp_model.successors[k]], dtype=np.int64)
+    else:
+        src = np.array([task_to_idx[p] for k in predecessors for p in predecessors[k]], dtype=np.int64)
+        dst = np.array([task_to_idx[k] for k in predecessors for p in predecessors[k]], dtype=np.int64)
+    pred_indptr = np.zeros(n+1, dtype=np.int64)
+    pred_indptr[1:] = np.cumsum(np.bincount(dst, minlength=n))
+    pred_indices = src[np.argsort(dst, kind="stable")]
+    succ_indptr = np.zeros(n+1, dtype=np.int64)
+    succ_indptr[1:] = np.cumsum(np.bincount(src, minlength=n))
+    succ_indices = dst[np.argsort(src, kind="stable")]
+    return pred_indptr, pred_indices, succ_indptr, succ_indices
+
+
+def sgs_cache(rcpsp_model: RCPSPModel):
+    # Read-only data used by the sgs (task indexes, precedence graph in CSR format, durations, consumptions),
+    # built on first call and kept on the model so that repeated sgs calls don't rebuild it.
+    cache = getattr(rcpsp_model, "_sgs_cache", None)
+    if cache is None:
+        tasks_list = list(rcpsp_model.tasks_list)
+        task_to_idx = {t: i for i, t in enumerate(tasks_list)}
+        resources_list = list(rcpsp_model.resources_list)
+        pred_indptr, pred_indices, succ_indptr, succ_indices = precedence_csr(rcpsp_model, task_to_idx)
+        cache = {"tasks_list": tasks_list,
+                 "task_to_idx": task_to_idx,
+                 "resources_list": resources_list,
+                 "pred_indptr": pred_indptr,
+                 "pred_indices": pred_indices,
+                 "succ_indptr": succ_indptr,
+                 "succ_indices": succ_indices,
+                 "duration_arr": np.array([rcpsp_model.mode_details[t][1]["duration"] for t in tasks_list],
+                                          dtype=np.int32),
+                 "need_arr": np.array([[rcpsp_model.mode_details[t][1].get(r, 0) for r in resources_list]
+                                       for t in tasks_list], dtype=np.int32),
+                 "non_renewable": np.array([r in rcpsp_model.non_renewable_resources for r in resources_list],
+                                           dtype=bool)}
+        # Zero duration tasks consuming no non-renewable resource (source, sink, milestones...) :
+        # scheduling them needs neither resource search nor resource update.
+        cache["instant"] = (cache["duration_arr"] == 0) & ~(cache["need_arr"][:, cache["non_renewable"]] != 0).any(axis=1)
+        for key in cache:
+            if isinstance(cache[key], np.ndarray):
+                cache[key].setflags(write=False)
+        rcpsp_model._sgs_cache = cache
+    return cache
+
+
 def sgs_algorithm(rcpsp_model: RCPSPModel, 
                   permutation_of_task: List[Hashable], predecessors=None):
-    # Compute predecessors for each task. 
+    cache = sgs_cache(rcpsp_model)
+    tasks_list = cache["tasks_list"]
+    task_to_idx = cache["task_to_idx"]
+    # Successors of each task in the precedence graph of the model (CSR format) : minimum start times are propagated along it.
+    succ_indptr, succ_indices = cache["succ_indptr"], cache["succ_indices"]
+    # Graph deciding when a task is ready to be scheduled (all its predecessors done) : the one of the model,
+    # or the one given by the predecessors argument, which doesn't change the minimum start times propagation.
     if predecessors is None:
-        predecessors = {k: set() for k in rcpsp_model.tasks_list}
-        for k in rcpsp_model.successors:
-            succ = rcpsp_model.successors[k]
-            for s in succ:
-                predecessors[s].add(k)
+        pred_indptr, ready_succ_indptr, ready_succ_indices = cache["pred_indptr"], succ_indptr, succ_indices
+    else:
+        pred_indptr, _, ready_succ_indptr, ready_succ_indices = precedence_csr(rcpsp_model, task_to_idx, predecessors)
     schedule = {k: {"start_time": None,
                     "end_time": None}
-                for k in rcpsp_model.tasks_list}
-    duration_task = {k: rcpsp_model.mode_details[k][1]["duration"] for k in rcpsp_model.mode_details}
-    resources_availability = {r: rcpsp_model.get_resource_availability_array(r) 
-                              for r in rcpsp_model.resources_list}
+                for k in tasks_list}
+    resources_list = cache["resources_list"]
+    duration_arr = cache["duration_arr"]
+    need_arr = cache["need_arr"]
+    non_renewable = cache["non_renewable"]
+    # Availability arrays padded with max duration zeros : windows going beyond the end of the calendar
+    # read zeros instead of a short slice, so a task using a resource can't run past the calendar.
+    padding = int(duration_arr.max()) if len(duration_arr) > 0 else 0
+    resources_availability = []
+    for r in resources_list:
+        calendar = np.asarray(rcpsp_model.get_resource_availability_array(r))
+        resources_availability += [np.concatenate([calendar, np.zeros(padding, dtype=calendar.dtype)])]
     
-    done = set()
+    n_done = 0
     minimum_time = {t: 0 for t in rcpsp_model.tasks_list}
+    perm_index = {task_to_idx[t]: i for i, t in enumerate(permutation_of_task)}
+    pred_remaining = (pred_indptr[1:]-pred_indptr[:-1]).astype(np.int32)
+    ready = [(perm_index[ti], ti) for ti in perm_index if pred_remaining[ti] == 0]
+    heapq.heapify(ready)
+    instant = cache["instant"]
+
+    def release_successors(task_idx, end_time):
+        for si in succ_indices[succ_indptr[task_idx]:succ_indptr[task_idx+1]]:
+            s = tasks_list[si]
+            minimum_time[s] = max(minimum_time[s], end_time)
+        for si in ready_succ_indices[ready_succ_indptr[task_idx]:ready_succ_indptr[task_idx+1]]:
+            pred_remaining[si] -= 1
+            if pred_remaining[si] == 0:
+                heapq.heappush(ready, (perm_index[si], si))
+
     while True:
-        # Select task to be scheduled at this round...
-        # etc
-        next_task = next(x for x in permutation_of_task 
-                         if all(p in done for p in predecessors[x]) 
-                         and x not in done)
+        # Batch of instant tasks (see sgs_cache) at the head of the ready heap, scheduled at their minimum time.
+        while ready and instant[ready[0][1]]:
+            _, task_idx = heapq.heappop(ready)
+            task = tasks_list[task_idx]
+            schedule[task]["start_time"] = minimum_time[task]
+            schedule[task]["end_time"] = minimum_time[task]
+            release_successors(task_idx, minimum_time[task])
+            n_done += 1
+        if n_done == len(tasks_list):
+            break
+        # Select task to be scheduled at this round :
+        # the ready task coming first in the permutation.
+        _, next_task_idx = heapq.heappop(ready)
+        next_task = tasks_list[next_task_idx]
         
-        if duration_task[next_task] == 0:
+        duration = int(duration_arr[next_task_idx])
+        if duration == 0:
             time_to_schedule_task = minimum_time[next_task]
         else:
-            time_to_schedule_task = next(t for t in range(minimum_time[next_task], rcpsp_model.horizon)
-                                         if 
-                                         all(min(resources_availability[r][t:t+duration_task[next_task]])>=
-                                             rcpsp_model.mode_details[next_task][1][r]
-                                             for r in resources_availability))
+            # Check the window [t, t+duration) resource by resource, if some time in the window lacks a resource,
+            # no window containing this time can be feasible : jump right after the last violated time.
+            time_to_schedule_task = minimum_time[next_task]
+            while time_to_schedule_task < rcpsp_model.horizon:
+                for ri in range(len(resources_list)):
+                    violated = (resources_availability[ri][time_to_schedule_task:time_to_schedule_task+duration]
+                                < need_arr[next_task_idx, ri])
+                    if violated.any():
+                        time_to_schedule_task += len(violated)-int(np.argmax(violated[::-1]))
+                        break
+                else:
+                    break
+            if time_to_schedule_task >= rcpsp_model.horizon:
+                # No slot before the horizon : the task is pushed at the horizon, the schedule won't be feasible.
+                time_to_schedule_task = max(minimum_time[next_task], rcpsp_model.horizon)
         schedule[next_task]["start_time"] = time_to_schedule_task
-        schedule[next_task]["end_time"] = time_to_schedule_task+duration_task[next_task]
-        for r in resources_availability:
-            need = rcpsp_model.mode_details[next_task][1][r]
-            if r in rcpsp_model.non_renewable_resources:
-                resources_availability[r][schedule[next_task]["start_time"]:]-=need
+        schedule[next_task]["end_time"] = time_to_schedule_task+duration
+        for ri in range(len(resources_list)):
+            need = need_arr[next_task_idx, ri]
+            if non_renewable[ri]:
+                resources_availability[ri][schedule[next_task]["start_time"]:len(resources_availability[ri])-padding]-=need
             else:
-                resources_availability[r][schedule[next_task]["start_time"]:schedule[next_task]["end_time"]]-=need
-        for s in rcpsp_model.successors[next_task]:
-            minimum_time[s] = max(minimum_time[s], schedule[next_task]["end_time"])
-        done.add(next_task) 
-        if all(x in done for x in schedule):
-            break
+                resources_availability[ri][schedule[next_task]["start_time"]:schedule[next_task]["end_time"]]-=need
+        release_successors(next_task_idx, schedule[next_task]["end_time"])
+        n_done += 1
     return schedule  
 
 